@@ -0,0 +1,162 @@
+import math
+import os
+import time
+from typing import Dict, Any
+from fastapi import HTTPException
+
+# Priority classes: interactive requests may use a backend's full limit, bulk writes only a share of it
+INTERACTIVE = "interactive"
+BULK_WRITE = "bulk_write"
+
+BULK_WRITE_SHARE = float(os.getenv("ADMISSION_BULK_WRITE_SHARE", "0.5"))
+
+class AdaptiveLimiter:
+    """Concurrency limit that shrinks when latency exceeds target and grows back up to its ceiling"""
+
+    def __init__(self, name: str, max_limit: int, min_limit: int = 1, target_latency: float = 0.5):
+        self.name = name
+        self.limit = float(max_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.in_flight = 0
+        # Tracked per priority: interactive latency drives the limit, bulk latency only Retry-After
+        self.avg_latency = {INTERACTIVE: 0.0, BULK_WRITE: 0.0}
+        self.last_decrease = 0.0
+        self.admitted = 0
+        self.rejected = 0
+
+    def has_capacity(self, share: float = 1.0) -> bool:
+        return self.in_flight < max(self.min_limit, math.floor(self.limit * share))
+
+    def acquire(self) -> None:
+        self.in_flight += 1
+        self.admitted += 1
+
+    def release(self, latency: float, priority: str = INTERACTIVE) -> None:
+        """Free a slot and adapt the limit: additive increase, multiplicative decrease"""
+        self.in_flight -= 1
+        average = self.avg_latency[priority]
+        self.avg_latency[priority] = latency if not average else 0.8 * average + 0.2 * latency
+        # Limits adapt to interactive latency only; long bulk writes would otherwise starve reads
+        if priority != INTERACTIVE:
+            return
+        if latency > self.target_latency:
+            # Decrease at most once per latency window; a burst of slow calls is one congestion signal
+            now = time.monotonic()
+            if now - self.last_decrease >= self.avg_latency[INTERACTIVE]:
+                self.limit = max(self.min_limit, self.limit * 0.9)
+                self.last_decrease = now
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def retry_after(self, priority: str = INTERACTIVE) -> int:
+        """Seconds a rejected client should wait, based on observed latency of its priority class"""
+        return max(1, math.ceil(self.avg_latency[priority]))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": math.floor(self.limit),
+            "max_limit": self.max_limit,
+            "in_flight": self.in_flight,
+            "avg_latency": {priority: round(latency, 4) for priority, latency in self.avg_latency.items()},
+            "admitted": self.admitted,
+            "rejected": self.rejected
+        }
+
+class AdmissionSlot:
+    """A reserved endpoint or backend slot; release it when the work finishes to feed its latency back"""
+
+    def __init__(self, limiter: AdaptiveLimiter, priority: str):
+        self.limiter = limiter
+        self.priority = priority
+        self.started = time.monotonic()
+        self.latency = None
+        self.released = False
+
+    def mark(self) -> None:
+        """Record the latency now, for slots held past the point that should drive the limit"""
+        self.latency = time.monotonic() - self.started
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            latency = self.latency if self.latency is not None else time.monotonic() - self.started
+            self.limiter.release(latency, self.priority)
+
+    def __enter__(self) -> "AdmissionSlot":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+class AdmissionController:
+    """Per-endpoint and per-backend admission control that rejects fast instead of queueing"""
+
+    def __init__(self, backend_limits: Dict[str, int], endpoint_limit: int = 64, target_latency: float = 0.5):
+        # Configured limits are ceilings; adaptation only ever lowers a limit below them
+        self.backends = {
+            name: AdaptiveLimiter(name, limit, target_latency=target_latency)
+            for name, limit in backend_limits.items()
+        }
+        self.endpoints: Dict[str, AdaptiveLimiter] = {}
+        self.endpoint_limit = endpoint_limit
+        self.target_latency = target_latency
+
+    def limit(self, endpoint: str, priority: str = INTERACTIVE, endpoint_limit: int = None):
+        """Build a FastAPI dependency that admits a request to an endpoint or rejects it with 429
+
+        FastAPI releases the dependency before a streamed body is sent; streaming endpoints
+        should call admit() themselves and release the slot when the body is done.
+        """
+        self._endpoint_limiter(endpoint, endpoint_limit)
+
+        async def dependency():
+            with self.admit(endpoint, priority):
+                yield
+
+        return dependency
+
+    def admit(self, endpoint: str, priority: str = INTERACTIVE, endpoint_limit: int = None) -> AdmissionSlot:
+        """Take an endpoint slot, or reject with 429 if the endpoint is at its limit"""
+        limiter = self._endpoint_limiter(endpoint, endpoint_limit)
+        if not limiter.has_capacity():
+            limiter.rejected += 1
+            raise HTTPException(
+                status_code=429,
+                detail=f"Too many concurrent requests to {endpoint}",
+                headers={"Retry-After": str(limiter.retry_after(priority))}
+            )
+        limiter.acquire()
+        return AdmissionSlot(limiter, priority)
+
+    def _endpoint_limiter(self, endpoint: str, endpoint_limit: int = None) -> AdaptiveLimiter:
+        if endpoint not in self.endpoints:
+            self.endpoints[endpoint] = AdaptiveLimiter(
+                endpoint, endpoint_limit or self.endpoint_limit, target_latency=self.target_latency
+            )
+        return self.endpoints[endpoint]
+
+    def reserve(self, backend: str, priority: str = INTERACTIVE) -> AdmissionSlot:
+        """Reserve a slot for one backend call, or reject with 503 if the backend is saturated"""
+        limiter = self.backends[backend]
+        if not limiter.has_capacity(BULK_WRITE_SHARE if priority == BULK_WRITE else 1.0):
+            limiter.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail=f"Backend {backend} is overloaded",
+                headers={"Retry-After": str(limiter.retry_after(priority))}
+            )
+        limiter.acquire()
+        return AdmissionSlot(limiter, priority)
+
+    def backend_capacity(self) -> int:
+        """Most backend calls that can be in flight at once across all backends"""
+        return sum(limiter.max_limit for limiter in self.backends.values())
+
+    def metrics(self) -> Dict[str, Any]:
+        """Get current limits and counters for every endpoint and backend"""
+        return {
+            "endpoints": {name: limiter.stats() for name, limiter in self.endpoints.items()},
+            "backends": {name: limiter.stats() for name, limiter in self.backends.items()}
+        }
@@ -0,0 +1,250 @@
+import json
+import re
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List, Optional, Tuple
+
+class FakeInfluxDBStore:
+    """In-memory sensor_data store fed by line protocol and read by the service's Flux queries"""
+
+    def __init__(self):
+        self.devices: Dict[str, Dict[str, Any]] = {}
+        self.points_written = 0
+        self.lock = threading.Lock()
+
+    def write(self, body: str) -> None:
+        for line in body.splitlines():
+            if not line.strip() or line.startswith("#"):
+                continue
+            measurement_and_tags, fields, timestamp = _split_line(line)
+            parts = _split_unescaped(measurement_and_tags, ",")
+            tags = dict(_split_unescaped(part, "=", maxsplit=1) for part in parts[1:])
+            tags = {_unescape(key): _unescape(value) for key, value in tags.items()}
+            values = {
+                _unescape(key): _parse_field_value(value)
+                for key, value in (_split_unescaped(field, "=", maxsplit=1) for field in _split_unescaped(fields, ","))
+            }
+            with self.lock:
+                device = self.devices.setdefault(tags.get("device_id"), {"tags": {}, "rows": []})
+                device["tags"].update(tags)
+                device["rows"].append((int(timestamp), values))
+                self.points_written += 1
+
+    def query(self, flux: str) -> str:
+        if "schema.tagValues" in flux:
+            tag = re.search(r'tag:\s*"([^"]+)"', flux).group(1)
+            with self.lock:
+                values = sorted({device["tags"][tag] for device in self.devices.values() if tag in device["tags"]})
+            return _csv_table(["_value"], ["string"], [[value] for value in values])
+        if "last()" in flux:
+            return self._query_last(_parse_columns(flux, "group"), _parse_columns(flux, "pivot"))
+        device_id = re.search(r'r\["device_id"\] == "([^"]+)"', flux).group(1)
+        return self._query_device(device_id, *_parse_range(flux))
+
+    def _query_device(self, device_id: str, start: int, stop: Optional[int]) -> str:
+        with self.lock:
+            device = self.devices.get(device_id)
+            if not device:
+                return ""
+            tags = dict(device["tags"])
+            rows = sorted(
+                (row for row in device["rows"] if row[0] >= start and (stop is None or row[0] < stop)),
+                key=lambda row: row[0]
+            )
+        if not rows:
+            return ""
+        field_names = sorted({name for _, values in rows for name in values})
+        sample = {name: value for _, values in rows for name, value in values.items()}
+        columns = ["_time", "_measurement", "device_id", "device_type"] + field_names
+        types = ["dateTime:RFC3339", "string", "string", "string"] + [_flux_type(sample[name]) for name in field_names]
+        data = [
+            [_rfc3339(timestamp), "sensor_data", device_id, tags.get("device_type", "")] +
+            [values.get(name, "") for name in field_names]
+            for timestamp, values in rows
+        ]
+        return _csv_table(columns, types, data)
+
+    def _query_last(self, group_columns: List[str], row_key: List[str]) -> str:
+        """Mirror last() |> group(columns) |> pivot(rowKey): one row per distinct last-write time
+
+        Like Flux's pivot(), only the row key, group key and pivoted field columns are returned.
+        """
+        key_columns = list(dict.fromkeys(row_key + group_columns))
+        tables = []
+        with self.lock:
+            devices = {device_id: (dict(d["tags"]), list(d["rows"])) for device_id, d in self.devices.items()}
+        for device_id, (tags, rows) in devices.items():
+            latest: Dict[str, Tuple[int, Any]] = {}
+            for timestamp, values in rows:
+                for name, value in values.items():
+                    if name not in latest or timestamp >= latest[name][0]:
+                        latest[name] = (timestamp, value)
+            field_names = sorted(latest)
+            by_time: Dict[int, Dict[str, Any]] = {}
+            for name, (timestamp, value) in latest.items():
+                by_time.setdefault(timestamp, {})[name] = value
+            columns = {"_measurement": "sensor_data", **tags}
+            tables.append(_csv_table(
+                key_columns + field_names,
+                ["dateTime:RFC3339" if column == "_time" else "string" for column in key_columns] +
+                [_flux_type(latest[name][1]) for name in field_names],
+                [
+                    [_rfc3339(timestamp) if column == "_time" else columns.get(column, "") for column in key_columns] +
+                    [values.get(name, "") for name in field_names]
+                    for timestamp, values in sorted(by_time.items())
+                ],
+                table=len(tables)
+            ))
+        return "\n".join(tables)
+
+def _parse_columns(flux: str, function: str) -> List[str]:
+    """Column list of group(columns: [...]) or pivot(rowKey: [...]) in a Flux query"""
+    argument = "columns" if function == "group" else "rowKey"
+    match = re.search(function + r"\(" + argument + r':\s*\[([^\]]*)\]', flux)
+    return re.findall(r'"([^"]+)"', match.group(1)) if match else []
+
+def _parse_range(flux: str) -> Tuple[int, Optional[int]]:
+    """Bounds of range(start:, stop:) in ns; start is inclusive and stop exclusive, as in Flux"""
+    match = re.search(r"range\(start:\s*([^,)]+?)\s*(?:,\s*stop:\s*([^,)]+?)\s*)?\)", flux)
+    if not match:
+        return 0, None
+    now = datetime.now(timezone.utc)
+    start = _parse_time(match.group(1), now)
+    stop = _parse_time(match.group(2), now) if match.group(2) else None
+    return start, stop
+
+def _parse_time(value: str, now: datetime) -> int:
+    """Parse a Flux time literal: 0, a relative duration like -30d, or an RFC3339 time (naive as UTC)"""
+    if value == "0":
+        return 0
+    duration = re.fullmatch(r"(-?)(\d+)(ns|us|ms|s|m|h|d|w)", value)
+    if duration:
+        units = {"ns": 1e-9, "us": 1e-6, "ms": 1e-3, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+        offset = timedelta(seconds=int(duration.group(2)) * units[duration.group(3)])
+        moment = now - offset if duration.group(1) else now + offset
+    else:
+        moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp()) * 1_000_000_000 + moment.microsecond * 1000
+
+def _split_unescaped(text: str, separator: str, maxsplit: int = -1) -> List[str]:
+    """Split on separator outside backslash escapes and double quotes"""
+    parts, current, escaped, quoted = [], [], False, False
+    for char in text:
+        if escaped:
+            current.append(char)
+            escaped = False
+        elif char == "\\":
+            current.append(char)
+            escaped = True
+        elif char == '"':
+            current.append(char)
+            quoted = not quoted
+        elif char == separator and not quoted and maxsplit != 0:
+            parts.append("".join(current))
+            current = []
+            maxsplit -= 1
+        else:
+            current.append(char)
+    parts.append("".join(current))
+    return parts
+
+def _split_line(line: str) -> Tuple[str, str, str]:
+    parts = _split_unescaped(line, " ")
+    return parts[0], parts[1], parts[2] if len(parts) > 2 else "0"
+
+def _unescape(text: str) -> str:
+    return re.sub(r"\\(.)", r"\1", text)
+
+def _parse_field_value(value: str) -> Any:
+    if value.startswith('"'):
+        return _unescape(value[1:-1])
+    if value in ("t", "T", "true", "True", "TRUE"):
+        return True
+    if value in ("f", "F", "false", "False", "FALSE"):
+        return False
+    if value.endswith("i"):
+        return int(value[:-1])
+    return float(value)
+
+def _flux_type(value: Any) -> str:
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, int):
+        return "long"
+    if isinstance(value, float):
+        return "double"
+    return "string"
+
+def _rfc3339(timestamp_ns: int) -> str:
+    seconds, nanos = divmod(timestamp_ns, 1_000_000_000)
+    moment = datetime.fromtimestamp(seconds, tz=timezone.utc).replace(microsecond=nanos // 1000)
+    return moment.isoformat().replace("+00:00", "Z")
+
+def _csv_value(value: Any) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    text = str(value)
+    if any(char in text for char in ',"\n'):
+        return '"' + text.replace('"', '""') + '"'
+    return text
+
+def _csv_table(columns: List[str], types: List[str], rows: List[List[Any]], table: int = 0) -> str:
+    """Render one annotated CSV table as returned by the /api/v2/query endpoint"""
+    lines = [
+        ",".join(["#datatype", "string", "long"] + types),
+        ",".join(["#group", "false", "false"] + ["false"] * len(columns)),
+        ",".join(["#default", "_result", ""] + [""] * len(columns)),
+        ",".join(["", "result", "table"] + columns)
+    ]
+    for row in rows:
+        lines.append(",".join(["", "", str(table)] + [_csv_value(value) for value in row]))
+    return "\r\n".join(lines) + "\r\n"
+
+class _FakeInfluxDBRequestHandler(BaseHTTPRequestHandler):
+    store: FakeInfluxDBStore = None
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+        if self.path.startswith("/api/v2/write"):
+            self.store.write(body)
+            self.send_response(204)
+            self.end_headers()
+        elif self.path.startswith("/api/v2/query"):
+            payload = self.store.query(json.loads(body)["query"]).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/csv; charset=utf-8")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        else:
+            self.send_response(404)
+            self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+class FakeInfluxDBServer:
+    """Threaded HTTP stand-in for the InfluxDB v2 write and query APIs"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.store = FakeInfluxDBStore()
+        handler = type("Handler", (_FakeInfluxDBRequestHandler,), {"store": self.store})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeInfluxDBServer":
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,467 @@
+"""Load and benchmark harness for the storage service.
+
+Runs the FastAPI ``app`` under uvicorn in its own process against local backend
+stand-ins (a fake InfluxDB HTTP server, a moto S3 server and either an in-memory
+SQLite stand-in or a real PostgreSQL) and replays a request mix at one or more
+concurrency levels, reporting throughput, latency percentiles and the service
+process's memory.
+
+    python -m benchmarks.run run --concurrency 1,8,32 --output results.json
+    python -m benchmarks.run compare baseline.json results.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import math
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional
+
+import httpx
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MIX = os.path.join(os.path.dirname(__file__), "mixes", "dashboard.json")
+S3_BUCKET = "benchmark-device-data"
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def rss_mb(pid: int) -> Optional[float]:
+    """Resident set size of a process in MiB, from /proc or ps"""
+    try:
+        with open(f"/proc/{pid}/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        pass
+    try:
+        output = subprocess.run(["ps", "-o", "rss=", "-p", str(pid)], capture_output=True, text=True).stdout
+        return int(output.strip()) / 2 ** 10
+    except (OSError, ValueError):
+        return None
+
+class RssSampler:
+    """Samples a process's RSS in the background to find its peak over a phase"""
+
+    def __init__(self, pid: int, interval: float = 0.02):
+        self.pid = pid
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self) -> None:
+        while not self._stop.is_set():
+            rss = rss_mb(self.pid)
+            if rss is not None and (self.peak is None or rss > self.peak):
+                self.peak = rss
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> "RssSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+
+def summarize(latencies: List[float], statuses: List[int], duration: float) -> Dict[str, Any]:
+    latencies = sorted(latencies)
+    status_counts: Dict[str, int] = {}
+    for status in statuses:
+        status_counts[str(status)] = status_counts.get(str(status), 0) + 1
+    return {
+        "requests": len(statuses),
+        "errors": sum(1 for status in statuses if status == 0 or (status >= 500 and status != 503)),
+        "rejected": sum(1 for status in statuses if status in (429, 503)),
+        "status_counts": status_counts,
+        "throughput_rps": round(len(statuses) / duration, 2) if duration else 0.0,
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+            "p50": round(percentile(latencies, 50) * 1000, 3),
+            "p95": round(percentile(latencies, 95) * 1000, 3),
+            "p99": round(percentile(latencies, 99) * 1000, 3),
+            "max": round(latencies[-1] * 1000, 3) if latencies else 0.0
+        }
+    }
+
+class Backends:
+    """Local stand-ins for InfluxDB and S3, exposed to the service through its own env config"""
+
+    def __init__(self):
+        self.influx = None
+        self.s3 = None
+        self.s3_url = None
+
+    def start(self) -> Dict[str, str]:
+        """Start the stand-ins and return the environment for the service process"""
+        from benchmarks.fake_influxdb import FakeInfluxDBServer
+        from moto.server import ThreadedMotoServer
+        import boto3
+
+        self.influx = FakeInfluxDBServer().start()
+        port = free_port()
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        self.s3 = ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+        self.s3.start()
+        self.s3_url = f"http://127.0.0.1:{port}"
+
+        env = {
+            "INFLUXDB_URL": self.influx.url,
+            "INFLUXDB_TOKEN": "benchmark",
+            "INFLUXDB_ORG": "benchmark",
+            "INFLUXDB_BUCKET": "benchmark",
+            "AWS_ACCESS_KEY_ID": "benchmark",
+            "AWS_SECRET_ACCESS_KEY": "benchmark",
+            "AWS_REGION": "us-east-1",
+            "AWS_ENDPOINT_URL_S3": self.s3_url,
+            "S3_BUCKET_NAME": S3_BUCKET
+        }
+        boto3.client(
+            "s3", region_name="us-east-1", endpoint_url=self.s3_url,
+            aws_access_key_id="benchmark", aws_secret_access_key="benchmark"
+        ).create_bucket(Bucket=S3_BUCKET)
+        return env
+
+    def stop(self) -> None:
+        if self.s3:
+            self.s3.stop()
+        if self.influx:
+            self.influx.stop()
+
+class AppProcess:
+    """Runs the service under uvicorn in a separate process (benchmarks/serve.py)"""
+
+    def __init__(self, env: Dict[str, str], postgres: str):
+        self.port = free_port()
+        self.env = {**os.environ, **env}
+        self.postgres = postgres
+        self.process = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def pid(self) -> int:
+        return self.process.pid
+
+    def start(self) -> None:
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.serve", "--port", str(self.port), "--postgres", self.postgres],
+            cwd=REPO_ROOT, env=self.env
+        )
+        deadline = time.monotonic() + 60
+        while True:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Service exited with code {self.process.returncode}")
+            try:
+                httpx.get(f"{self.url}/metrics/admission", timeout=1).raise_for_status()
+                return
+            except httpx.HTTPError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("Service did not start")
+                time.sleep(0.1)
+
+    def stop(self) -> None:
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+class RequestMix:
+    """Weighted synthetic mix, or a recorded sequence replayed in order when no entry has a weight"""
+
+    def __init__(self, spec: Dict[str, Any], rng: random.Random):
+        self.name = spec.get("name", "mix")
+        self.entries = spec["requests"]
+        for entry in self.entries:
+            entry.setdefault("name", f"{entry['method']} {entry['path']}")
+        self.weighted = any("weight" in entry for entry in self.entries)
+        self.rng = rng
+
+    @classmethod
+    def load(cls, path: str, rng: random.Random) -> "RequestMix":
+        with open(path) as mix_file:
+            return cls(json.load(mix_file), rng)
+
+    def endpoints(self) -> List[Dict[str, Any]]:
+        """Distinct request templates, used to benchmark each endpoint in isolation"""
+        return list({entry["name"]: entry for entry in self.entries}.values())
+
+    def stream(self):
+        if not self.weighted:
+            yield from itertools.cycle(self.entries)
+        weights = [entry.get("weight", 1) for entry in self.entries]
+        while True:
+            yield self.rng.choices(self.entries, weights)[0]
+
+class LoadRunner:
+    """Replays request templates against the service at a fixed concurrency"""
+
+    def __init__(self, base_url: str, device_ids: List[str], image_keys: List[Dict[str, str]],
+                 window: Dict[str, str], rng: random.Random):
+        self.base_url = base_url
+        self.device_ids = device_ids
+        self.image_keys = image_keys
+        self.window = window
+        self.rng = rng
+        self.payloads: Dict[int, bytes] = {}
+
+    def _render(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        values = {"device_id": self.rng.choice(self.device_ids), **self.window}
+        if self.image_keys:
+            image = self.rng.choice(self.image_keys)
+            if "{image_key}" in json.dumps(entry):
+                values.update(device_id=image["device_id"], image_key=image["key"])
+        request = {
+            "method": entry["method"],
+            "url": entry["path"].format(**values),
+            "params": {key: str(value).format(**values) for key, value in entry.get("params", {}).items()},
+            "headers": entry.get("headers", {})
+        }
+        upload = entry.get("upload")
+        if upload:
+            size = upload.get("size", 65536)
+            if size not in self.payloads:
+                self.payloads[size] = os.urandom(size)
+            request["files"] = {"file": ("benchmark.jpg", self.payloads[size], upload.get("content_type", "image/jpeg"))}
+        return request
+
+    async def run(self, entries, total_requests: int, concurrency: int) -> Dict[str, Dict[str, list]]:
+        samples: Dict[str, Dict[str, list]] = {}
+        remaining = iter(range(total_requests))
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+        async with httpx.AsyncClient(base_url=self.base_url, limits=limits, timeout=120) as client:
+            async def worker():
+                for _ in remaining:
+                    entry = next(entries)
+                    request = self._render(entry)
+                    started = time.perf_counter()
+                    try:
+                        response = await client.request(**request)
+                        await response.aread()
+                        status = response.status_code
+                    except httpx.HTTPError:
+                        status = 0
+                    latency = time.perf_counter() - started
+                    sample = samples.setdefault(entry["name"], {"latencies": [], "statuses": []})
+                    sample["latencies"].append(latency)
+                    sample["statuses"].append(status)
+
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return samples
+
+def seed(base_url: str, num_devices: int, images_per_device: int, image_size: int) -> Dict[str, Any]:
+    """Populate the stand-ins through the public API so every endpoint has data to serve"""
+    with httpx.Client(base_url=base_url, timeout=300) as client:
+        seed_started = datetime.utcnow()
+        client.post("/generate-and-store", params={"num_devices": num_devices}).raise_for_status()
+        # A fixed window over the seeded series keeps sensor-data payloads the same in every phase
+        window = {
+            "window_start": (seed_started - timedelta(hours=24, seconds=1)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "window_end": (datetime.utcnow() + timedelta(seconds=1)).strftime("%Y-%m-%dT%H:%M:%SZ")
+        }
+        device_ids = [device["device_id"] for device in client.get("/devices").json()]
+        image_keys = []
+        for index in range(images_per_device):
+            for device_id in device_ids:
+                response = client.post(
+                    f"/devices/{device_id}/images",
+                    files={"file": (f"seed-{index}.jpg", os.urandom(image_size), "image/jpeg")}
+                )
+                response.raise_for_status()
+                key = response.json()["image_url"].split("/", 3)[3]
+                image_keys.append({"device_id": device_id, "key": key})
+    return {"device_ids": device_ids, "image_keys": image_keys, "window": window}
+
+def bulk_written_device_ids(mix: RequestMix) -> List[str]:
+    """Device ids rewritten by /generate-and-store entries, which number devices device_1..device_N"""
+    num_devices = max(
+        (int(entry.get("params", {}).get("num_devices", 5)) for entry in mix.entries
+         if entry["path"] == "/generate-and-store"),
+        default=0
+    )
+    return [f"device_{index + 1}" for index in range(num_devices)]
+
+async def run_phase(runner: LoadRunner, name: str, entries, total_requests: int, concurrency: int,
+                    pid: int) -> Dict[str, Any]:
+    rss_before = rss_mb(pid)
+    with RssSampler(pid) as sampler:
+        started = time.perf_counter()
+        samples = await runner.run(entries, total_requests, concurrency)
+        duration = time.perf_counter() - started
+    rss_after = rss_mb(pid)
+
+    # Memory of the service process only; the load generator and stand-ins run elsewhere
+    memory = {
+        "rss_mb_before": _round(rss_before),
+        "rss_mb_after": _round(rss_after),
+        "rss_mb_peak": _round(sampler.peak),
+        "rss_mb_peak_delta": _round(sampler.peak - rss_before if sampler.peak and rss_before else None)
+    }
+
+    all_latencies = [latency for sample in samples.values() for latency in sample["latencies"]]
+    all_statuses = [status for sample in samples.values() for status in sample["statuses"]]
+    return {
+        "phase": name,
+        "concurrency": concurrency,
+        "duration_s": round(duration, 3),
+        "memory": memory,
+        "total": summarize(all_latencies, all_statuses, duration),
+        "endpoints": {
+            endpoint: summarize(sample["latencies"], sample["statuses"], duration)
+            for endpoint, sample in sorted(samples.items())
+        }
+    }
+
+def run_benchmark(args) -> Dict[str, Any]:
+    started_at = datetime.utcnow().isoformat()
+    rng = random.Random(args.seed)
+    mix = RequestMix.load(args.mix, rng)
+    backends = Backends()
+    try:
+        app = AppProcess(backends.start(), args.postgres)
+        app.start()
+        try:
+            seeded = seed(app.url, args.devices, args.images_per_device, args.image_size)
+            # Read from devices the mix's bulk writes do not touch so their series stay fixed
+            bulk_ids = set(bulk_written_device_ids(mix))
+            read_ids = [device_id for device_id in seeded["device_ids"] if device_id not in bulk_ids]
+            if not read_ids:
+                print("warning: every seeded device is rewritten by the mix; raise --devices", file=sys.stderr)
+                read_ids = seeded["device_ids"]
+            image_keys = [image for image in seeded["image_keys"] if image["device_id"] in read_ids]
+            runner = LoadRunner(app.url, read_ids, image_keys, seeded["window"], rng)
+
+            phases = []
+            for concurrency in args.concurrency:
+                if args.mode in ("isolated", "both"):
+                    for entry in mix.endpoints():
+                        total = min(entry.get("requests", args.requests), args.requests)
+                        phases.append(asyncio.run(run_phase(
+                            runner, f"isolated:{entry['name']}", itertools.repeat(entry), total,
+                            concurrency, app.pid
+                        )))
+                        print(_format_phase(phases[-1]), file=sys.stderr)
+                if args.mode in ("mix", "both"):
+                    phases.append(asyncio.run(run_phase(
+                        runner, f"mix:{mix.name}", mix.stream(), args.requests, concurrency, app.pid
+                    )))
+                    print(_format_phase(phases[-1]), file=sys.stderr)
+        finally:
+            app.stop()
+    finally:
+        backends.stop()
+
+    return {
+        "meta": {
+            "started_at": started_at,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "mix": mix.name,
+            "postgres": args.postgres,
+            "requests_per_phase": args.requests,
+            "devices": args.devices,
+            "read_devices": len(read_ids),
+            "seed": args.seed,
+            "influx_points_written": backends.influx.store.points_written
+        },
+        "phases": phases
+    }
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 2) if value is not None else None
+
+def _format_phase(phase: Dict[str, Any]) -> str:
+    total = phase["total"]
+    return (f"{phase['phase']:<36} c={phase['concurrency']:<4} {total['throughput_rps']:>9.1f} rps  "
+            f"p50={total['latency_ms']['p50']:>9.2f}ms p95={total['latency_ms']['p95']:>9.2f}ms "
+            f"p99={total['latency_ms']['p99']:>9.2f}ms  errors={total['errors']} rejected={total['rejected']}  "
+            f"rss_peak={phase['memory']['rss_mb_peak'] or 0:.1f}MiB")
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Per phase/endpoint deltas between two result files; positive latency change is a regression"""
+    def index(results):
+        return {
+            (phase["phase"], phase["concurrency"], endpoint): stats
+            for phase in results["phases"]
+            for endpoint, stats in phase["endpoints"].items()
+        }
+
+    before, after = index(baseline), index(current)
+    rows = []
+    for key in sorted(before.keys() & after.keys()):
+        old, new = before[key], after[key]
+        row = {"phase": key[0], "concurrency": key[1], "endpoint": key[2]}
+        for metric in ("p50", "p95", "p99"):
+            row[f"{metric}_change_pct"] = _change(old["latency_ms"][metric], new["latency_ms"][metric])
+        row["throughput_change_pct"] = _change(old["throughput_rps"], new["throughput_rps"])
+        rows.append(row)
+    return rows
+
+def _change(old: float, new: float) -> Optional[float]:
+    return round((new - old) / old * 100, 2) if old else None
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Run the benchmark and write JSON results")
+    run.add_argument("--mix", default=DEFAULT_MIX, help="Request mix JSON file (weighted or recorded)")
+    run.add_argument("--concurrency", default="1,8,32",
+                     type=lambda value: [int(level) for level in value.split(",")],
+                     help="Comma-separated concurrency levels")
+    run.add_argument("--requests", type=int, default=200, help="Requests per phase")
+    run.add_argument("--mode", choices=["isolated", "mix", "both"], default="both",
+                     help="Benchmark each endpoint alone, the full mix, or both")
+    run.add_argument("--devices", type=int, default=10, help="Devices to seed")
+    run.add_argument("--images-per-device", type=int, default=1)
+    run.add_argument("--image-size", type=int, default=1024 * 1024, help="Seed image size in bytes")
+    run.add_argument("--postgres", choices=["sqlite", "real"], default="sqlite",
+                     help="Use an in-memory SQLite stand-in, or the POSTGRES_* database (its tables are recreated)")
+    run.add_argument("--seed", type=int, default=42)
+    run.add_argument("--output", help="Write JSON results to this file instead of stdout")
+
+    diff = commands.add_parser("compare", help="Compare two JSON result files")
+    diff.add_argument("baseline")
+    diff.add_argument("current")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "compare":
+        with open(args.baseline) as baseline, open(args.current) as current:
+            print(json.dumps(compare(json.load(baseline), json.load(current)), indent=2))
+        return
+
+    results = run_benchmark(args)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+"""Run the service under uvicorn for the benchmark harness, optionally on the SQLite PostgreSQL stand-in.
+
+Started by benchmarks/run.py in its own process so the service's memory and CPU are measured apart
+from the load generator and the backend stand-ins.
+"""
+import argparse
+import os
+import sys
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--postgres", choices=["sqlite", "real"], default="sqlite")
+    args = parser.parse_args(argv)
+
+    if args.postgres == "sqlite":
+        import psycopg2
+        from benchmarks import sqlite_postgres
+
+        psycopg2.connect = sqlite_postgres.connect
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import uvicorn
+    import main as service
+
+    uvicorn.run(service.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import re
+import sqlite3
+from typing import Any, Dict, List, Optional, Sequence
+
+def _translate(sql: str) -> str:
+    """Rewrite the PostgreSQL dialect used by PostgreSQLHandler into SQLite"""
+    sql = sql.replace("%s", "?")
+    sql = re.sub(r"\bSERIAL PRIMARY KEY\b", "INTEGER PRIMARY KEY AUTOINCREMENT", sql)
+    sql = re.sub(r"\s+CASCADE\b", "", sql)
+    return sql
+
+class SQLiteCursor:
+    """Subset of a psycopg2 RealDictCursor backed by SQLite"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+        self._cursor = conn.cursor()
+
+    def execute(self, sql: str, params: Optional[Sequence[Any]] = None) -> None:
+        sql = _translate(sql)
+        if params:
+            self._cursor.execute(sql, list(params))
+        elif sql.count(";") > 1:
+            self._cursor.executescript(sql)
+        else:
+            self._cursor.execute(sql)
+
+    def fetchall(self) -> List[Dict[str, Any]]:
+        columns = [column[0] for column in self._cursor.description or []]
+        return [dict(zip(columns, row)) for row in self._cursor.fetchall()]
+
+    def close(self) -> None:
+        self._cursor.close()
+
+class SQLiteConnection:
+    """Subset of a psycopg2 connection backed by an in-memory SQLite database"""
+
+    def __init__(self, database: str = ":memory:"):
+        # PostgreSQLHandler serializes cursor use itself, so cross-thread access is safe here
+        self._conn = sqlite3.connect(database, check_same_thread=False)
+
+    def cursor(self, cursor_factory=None) -> SQLiteCursor:
+        return SQLiteCursor(self._conn)
+
+    def commit(self) -> None:
+        self._conn.commit()
+
+    def rollback(self) -> None:
+        self._conn.rollback()
+
+    def close(self) -> None:
+        self._conn.close()
+
+def connect(**kwargs) -> SQLiteConnection:
+    """Drop-in for psycopg2.connect that ignores the PostgreSQL connection settings"""
+    return SQLiteConnection()
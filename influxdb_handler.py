@@ -1,10 +1,12 @@
 import os
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import influxdb_client
 from influxdb_client.client.write_api import SYNCHRONOUS
 from dotenv import load_dotenv
 from influxdb_client import InfluxDBClient, Point
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
+from latest_index import LatestReadingIndex
+from tag_catalog import TagCatalog
 
 load_dotenv()
 
@@ -15,10 +17,20 @@ class InfluxDBHandler:
             token=os.getenv("INFLUXDB_TOKEN"),
             org=os.getenv("INFLUXDB_ORG")
         )
+        self.org = os.getenv("INFLUXDB_ORG")
         self.bucket = os.getenv("INFLUXDB_BUCKET")
         self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
+        self.latest_index = LatestReadingIndex()
+        self.tag_catalog = TagCatalog(["device_type", "location"])
+        # schema.tagValues filters on point time, so incremental refreshes re-scan a lookback window
+        # for backdated writes and a periodic full refresh catches anything older
+        self.tag_catalog_lookback = timedelta(hours=float(os.getenv("TAG_CATALOG_LOOKBACK_HOURS", "48")))
+        self.tag_catalog_full_refresh = timedelta(seconds=float(os.getenv("TAG_CATALOG_FULL_REFRESH_SECONDS", "3600")))
+        self._tag_catalog_refreshed_at = None
+        self._tag_catalog_full_refreshed_at = None
 
-    def store_sensor_data(self, *, device_id: str, device_type: str, sensor_data: List[Dict[str, Any]]) -> bool:
+    def store_sensor_data(self, *, device_id: str, device_type: str, sensor_data: List[Dict[str, Any]],
+                          location: str = None) -> bool:
         """Store sensor data in InfluxDB"""
         try:
             for data_point in sensor_data:
@@ -27,6 +39,8 @@ class InfluxDBHandler:
                     .tag("device_id", device_id) \
                     .tag("device_type", device_type) \
                     .time(data_point["timestamp"])
+                if location:
+                    point.tag("location", location)
                 
                 # Add all fields from the sensor data
                 for key, value in data_point.items():
@@ -39,6 +53,8 @@ class InfluxDBHandler:
                     org=os.getenv("INFLUXDB_ORG"),
                     record=point
                 )
+            self.latest_index.update_from_points(device_id, device_type, sensor_data)
+            self.tag_catalog.record({"device_type": device_type, "location": location})
             return True
         except Exception as e:
             print(f"Error storing sensor data: {str(e)}")
@@ -78,49 +94,98 @@ class InfluxDBHandler:
             print(f"Error querying sensor data: {str(e)}")
             return []
 
-    def query_device_types(self) -> List[str]:
-        """Query all unique device types"""
+    def query_latest_readings(self) -> List[Dict[str, Any]]:
+        """Query the most recent point written for every device"""
         try:
+            # last() is per field; pivoting on _time regroups the values into real points,
+            # and the index keeps the newest one per device. pivot() drops columns outside the
+            # group key and rowKey, so device_type must be part of the group key
             query = f'''
             from(bucket: "{self.bucket}")
-                |> range(start: -30d)
+                |> range(start: 0)
                 |> filter(fn: (r) => r["_measurement"] == "sensor_data")
-                |> distinct(column: "device_type")
+                |> last()
+                |> group(columns: ["device_id", "device_type"])
+                |> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")
             '''
-            
-            result = self.client.query_api().query(query)
-            device_types = []
-            
+
+            result = self.client.query_api().query(query=query, org=self.org)
+            readings = []
             for table in result:
                 for record in table.records:
-                    device_types.append(record.values.get("device_type"))
-            
-            return list(set(device_types))
+                    record_data = {
+                        "timestamp": record.get_time().isoformat(),
+                        "device_id": record.values.get("device_id"),
+                        "device_type": record.values.get("device_type")
+                    }
+                    # Fields last written at another time come back as nulls on this row
+                    for key, value in record.values.items():
+                        if key not in ["result", "table", "_start", "_stop", "_time", "_measurement",
+                                       "device_id", "device_type", "location"] and value is not None:
+                            record_data[key] = value
+                    readings.append(record_data)
+            return readings
         except Exception as e:
-            print(f"Error querying device types: {str(e)}")
+            print(f"Error querying latest readings: {str(e)}")
             return []
 
-    def query_device_locations(self) -> List[str]:
-        """Query all unique device locations"""
+    def rebuild_latest_index(self) -> int:
+        """Rebuild the in-memory latest-reading index from InfluxDB"""
+        self.latest_index.rebuild(self.query_latest_readings())
+        return len(self.latest_index)
+
+    def query_tag_values(self, tag: str, start: str = "0") -> Optional[List[str]]:
+        """Query distinct values of a tag using the schema metadata API, or None if the query failed"""
         try:
             query = f'''
-            from(bucket: "{self.bucket}")
-                |> range(start: -30d)
-                |> filter(fn: (r) => r["_measurement"] == "sensor_data")
-                |> distinct(column: "location")
+            import "influxdata/influxdb/schema"
+
+            schema.tagValues(
+                bucket: "{self.bucket}",
+                tag: "{tag}",
+                predicate: (r) => r["_measurement"] == "sensor_data",
+                start: {start}
+            )
             '''
-            
-            result = self.client.query_api().query(query)
-            locations = []
-            
-            for table in result:
-                for record in table.records:
-                    locations.append(record.values.get("location"))
-            
-            return list(set(locations))
+
+            result = self.client.query_api().query(query=query, org=self.org)
+            return [record.get_value() for table in result for record in table.records]
         except Exception as e:
-            print(f"Error querying device locations: {str(e)}")
-            return []
+            print(f"Error querying tag values for {tag}: {str(e)}")
+            return None
+
+    def refresh_tag_catalog(self) -> bool:
+        """Merge tag values seen since the last refresh (minus the lookback) into the tag catalog"""
+        refreshed_at = datetime.now(timezone.utc)
+        full = (self._tag_catalog_full_refreshed_at is None or
+                refreshed_at - self._tag_catalog_full_refreshed_at >= self.tag_catalog_full_refresh)
+        if full:
+            start = "0"
+        else:
+            start = (self._tag_catalog_refreshed_at - self.tag_catalog_lookback).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+        succeeded = True
+        for tag in self.tag_catalog.tag_keys:
+            values = self.query_tag_values(tag, start)
+            if values is None:
+                succeeded = False
+                continue
+            self.tag_catalog.merge(tag, values)
+
+        # Keep the old watermark after a failure so the next refresh covers the missed window
+        if succeeded:
+            self._tag_catalog_refreshed_at = refreshed_at
+            if full:
+                self._tag_catalog_full_refreshed_at = refreshed_at
+        return succeeded
+
+    def query_device_types(self) -> List[str]:
+        """Query all unique device types"""
+        return self.tag_catalog.values("device_type")
+
+    def query_device_locations(self) -> List[str]:
+        """Query all unique device locations"""
+        return self.tag_catalog.values("location")
 
     def close(self):
         """Close the InfluxDB client connection"""
@@ -0,0 +1,89 @@
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional
+
+class LatestReading:
+    """Most recent sensor reading for a single device"""
+    __slots__ = ("device_id", "device_type", "epoch", "fields")
+
+    def __init__(self, device_id: str, device_type: str, epoch: float, fields: Dict[str, Any]):
+        self.device_id = device_id
+        self.device_type = device_type
+        self.epoch = epoch
+        self.fields = fields
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Render the reading in the same shape as query_sensor_data rows"""
+        record_data = {
+            "timestamp": datetime.fromtimestamp(self.epoch, tz=timezone.utc).isoformat(),
+            "device_id": self.device_id,
+            "device_type": self.device_type
+        }
+        record_data.update(self.fields)
+        return record_data
+
+def to_epoch(timestamp: Any) -> float:
+    """Convert an ISO string or datetime to epoch seconds, treating naive values as UTC"""
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.timestamp()
+
+class LatestReadingIndex:
+    """In-process last-value index of sensor readings keyed by device_id"""
+
+    def __init__(self):
+        self._readings: Dict[str, LatestReading] = {}
+        self._lock = threading.Lock()
+
+    def update(self, device_id: str, device_type: str, timestamp: Any, fields: Dict[str, Any]) -> None:
+        """Record a reading, keeping it only if it is newer than the stored one"""
+        epoch = to_epoch(timestamp)
+        with self._lock:
+            current = self._readings.get(device_id)
+            if current is None or epoch >= current.epoch:
+                self._readings[device_id] = LatestReading(device_id, device_type, epoch, dict(fields))
+
+    def update_from_points(self, device_id: str, device_type: str, sensor_data: List[Dict[str, Any]]) -> None:
+        """Record the newest point of a batch of sensor data"""
+        if not sensor_data:
+            return
+        newest = max(sensor_data, key=lambda data_point: to_epoch(data_point["timestamp"]))
+        fields = {key: value for key, value in newest.items() if key != "timestamp"}
+        self.update(device_id, device_type, newest["timestamp"], fields)
+
+    def rebuild(self, readings: List[Dict[str, Any]]) -> None:
+        """Replace the index contents with readings shaped like query_sensor_data rows"""
+        rebuilt = {}
+        for reading in readings:
+            fields = {
+                key: value for key, value in reading.items()
+                if key not in ["timestamp", "device_id", "device_type"]
+            }
+            record = LatestReading(reading["device_id"], reading.get("device_type"),
+                                   to_epoch(reading["timestamp"]), fields)
+            current = rebuilt.get(record.device_id)
+            if current is None or record.epoch >= current.epoch:
+                rebuilt[record.device_id] = record
+        with self._lock:
+            self._readings = rebuilt
+
+    def get(self, device_id: str) -> Optional[Dict[str, Any]]:
+        """Get the latest reading for a device, or None if unknown"""
+        reading = self._readings.get(device_id)
+        return reading.to_dict() if reading else None
+
+    def get_all(self) -> List[Dict[str, Any]]:
+        """Get the latest reading for every known device"""
+        with self._lock:
+            readings = list(self._readings.values())
+        return [reading.to_dict() for reading in readings]
+
+    def remove(self, device_id: str) -> None:
+        """Drop a device from the index"""
+        with self._lock:
+            self._readings.pop(device_id, None)
+
+    def __len__(self) -> int:
+        return len(self._readings)
@@ -1,12 +1,21 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from botocore.exceptions import ClientError
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import uvicorn
 from data_generator import IoTDataGenerator
 from influxdb_handler import InfluxDBHandler
 from postgres_handler import PostgreSQLHandler
-from s3_handler import S3Handler
+from s3_handler import S3Handler, IMAGE_CONTENT_TYPES
+from single_flight import SingleFlight
+from admission_control import AdmissionController, BULK_WRITE
 
 app = FastAPI(title="Smart Home IoT Data Service")
 
@@ -25,59 +34,136 @@ influx_handler = InfluxDBHandler()
 postgres_handler = PostgreSQLHandler()
 s3_handler = S3Handler()
 
-@app.post("/generate-and-store")
+# Coalesce identical concurrent reads into one backend call
+read_coalescer = SingleFlight()
+
+# Bound concurrency per endpoint and per backend, rejecting with 429/503 instead of queueing
+admission = AdmissionController(
+    backend_limits={
+        "influx": int(os.getenv("ADMISSION_INFLUX_LIMIT", "16")),
+        "postgres": int(os.getenv("ADMISSION_POSTGRES_LIMIT", "8")),
+        "s3": int(os.getenv("ADMISSION_S3_LIMIT", "32"))
+    },
+    target_latency=float(os.getenv("ADMISSION_TARGET_LATENCY", "0.5"))
+)
+
+TAG_CATALOG_REFRESH_SECONDS = int(os.getenv("TAG_CATALOG_REFRESH_SECONDS", "300"))
+STREAM_CHUNK_SIZE = 64 * 1024
+# Worker threads beyond the backend slots, for startup and tag catalog refreshes
+BACKGROUND_THREADS = 4
+
+@app.on_event("startup")
+async def configure_thread_pool():
+    """Size the worker pool to the backend limits so admitted calls never queue for a thread"""
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=admission.backend_capacity() + BACKGROUND_THREADS)
+    )
+
+@app.on_event("startup")
+async def rebuild_latest_index():
+    """Warm the latest-reading index from InfluxDB"""
+    await asyncio.to_thread(influx_handler.rebuild_latest_index)
+
+@app.on_event("startup")
+async def start_tag_catalog_refresh():
+    """Load the tag catalog and keep it incrementally refreshed"""
+    await asyncio.to_thread(influx_handler.refresh_tag_catalog)
+
+    async def refresh_loop():
+        while True:
+            await asyncio.sleep(TAG_CATALOG_REFRESH_SECONDS)
+            await asyncio.to_thread(influx_handler.refresh_tag_catalog)
+
+    app.state.tag_catalog_task = asyncio.create_task(refresh_loop())
+
+@app.on_event("shutdown")
+async def stop_tag_catalog_refresh():
+    """Stop the tag catalog refresh loop"""
+    app.state.tag_catalog_task.cancel()
+    try:
+        await app.state.tag_catalog_task
+    except asyncio.CancelledError:
+        pass
+
+def store_generated_dataset(dataset: Dict[str, Any]):
+    """Store a generated dataset in each database"""
+    for device in dataset["devices"]:
+        device_id = device["device_id"]
+        device_type = device["device_type"]
+        location = device["location"]
+        
+        # Generate time series data for InfluxDB
+        sensor_data = data_generator.generate_time_series_data(device_id, device_type, hours=24)
+        
+        # Store sensor data in InfluxDB
+        influx_handler.store_sensor_data(
+            device_id=device_id,
+            device_type=device_type,
+            sensor_data=sensor_data,
+            location=location
+        )
+        
+        # Store metadata in PostgreSQL
+        postgres_handler.store_device_metadata(dataset["metadata"][device_id])
+        
+        # Store logs in PostgreSQL
+        for log in dataset["logs"][device_id]:
+            postgres_handler.store_system_log(log)
+
+@app.post("/generate-and-store", dependencies=[Depends(
+    admission.limit("generate-and-store", priority=BULK_WRITE, endpoint_limit=4)
+)])
 async def generate_and_store_data(num_devices: int = 5):
     """Generate and store dummy IoT device data"""
     try:
         # Generate complete dataset
         dataset = data_generator.generate_complete_dataset(num_devices)
         
-        # Store data in each database
-        for device in dataset["devices"]:
-            device_id = device["device_id"]
-            device_type = device["device_type"]
-            
-            # Generate time series data for InfluxDB
-            sensor_data = data_generator.generate_time_series_data(device_id, device_type, hours=24)
-            
-            # Store sensor data in InfluxDB
-            influx_handler.store_sensor_data(
-                device_id=device_id,
-                device_type=device_type,
-                sensor_data=sensor_data
-            )
-            
-            # Store metadata in PostgreSQL
-            postgres_handler.store_device_metadata(dataset["metadata"][device_id])
-            
-            # Store logs in PostgreSQL
-            for log in dataset["logs"][device_id]:
-                postgres_handler.store_system_log(log)
+        # Store off the event loop so reads keep being served
+        with admission.reserve("influx", BULK_WRITE), admission.reserve("postgres", BULK_WRITE):
+            await asyncio.to_thread(store_generated_dataset, dataset)
         
         return {"message": f"Successfully generated and stored data for {num_devices} devices"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/devices")
+@app.get("/devices", dependencies=[Depends(admission.limit("devices"))])
 async def get_devices():
     """Get all devices and their metadata"""
     try:
-        return postgres_handler.get_device_metadata()
+        return await read_coalescer.do("postgres.get_device_metadata", postgres_handler.get_device_metadata,
+                                       reserve=partial(admission.reserve, "postgres"))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/devices/latest")
+async def get_latest_readings():
+    """Get the latest sensor reading for every device"""
+    try:
+        return influx_handler.latest_index.get_all()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/devices/{device_id}")
+@app.get("/devices/{device_id}", dependencies=[Depends(admission.limit("device"))])
 async def get_device(device_id: str):
     """Get specific device metadata"""
     try:
-        devices = postgres_handler.get_device_metadata(device_id)
+        devices = await read_coalescer.do("postgres.get_device_metadata",
+                                          postgres_handler.get_device_metadata, device_id,
+                                          reserve=partial(admission.reserve, "postgres"))
         if not devices:
             raise HTTPException(status_code=404, detail="Device not found")
         return devices[0]
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/devices/{device_id}/sensor-data")
+@app.get("/devices/{device_id}/sensor-data", dependencies=[Depends(admission.limit("sensor-data"))])
 async def get_device_sensor_data(
     device_id: str,
     start_time: Optional[str] = None,
@@ -85,16 +171,30 @@ async def get_device_sensor_data(
 ):
     """Get sensor data for a specific device"""
     try:
+        # Whole-second defaults so identical requests in the same second can be coalesced
+        now = datetime.utcnow().replace(microsecond=0)
         if not start_time:
-            start_time = (datetime.utcnow() - timedelta(hours=24)).isoformat()
+            start_time = (now - timedelta(hours=24)).isoformat()
         if not end_time:
-            end_time = datetime.utcnow().isoformat()
+            end_time = now.isoformat()
         
-        return influx_handler.query_sensor_data(device_id, start_time, end_time)
+        return await read_coalescer.do("influx.query_sensor_data",
+                                       influx_handler.query_sensor_data, device_id, start_time, end_time,
+                                       reserve=partial(admission.reserve, "influx"))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/devices/{device_id}/logs")
+@app.get("/devices/{device_id}/latest")
+async def get_device_latest_reading(device_id: str):
+    """Get the latest sensor reading for a specific device"""
+    reading = influx_handler.latest_index.get(device_id)
+    if reading is None:
+        raise HTTPException(status_code=404, detail="No readings for device")
+    return reading
+
+@app.get("/devices/{device_id}/logs", dependencies=[Depends(admission.limit("logs"))])
 async def get_device_logs(
     device_id: str,
     start_time: Optional[str] = None,
@@ -102,35 +202,156 @@ async def get_device_logs(
 ):
     """Get system logs for a specific device"""
     try:
-        return postgres_handler.get_system_logs(device_id, start_time, end_time)
+        return await read_coalescer.do("postgres.get_system_logs",
+                                       postgres_handler.get_system_logs, device_id, start_time, end_time,
+                                       reserve=partial(admission.reserve, "postgres"))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/devices/{device_id}/images")
+@app.post("/devices/{device_id}/images", dependencies=[Depends(admission.limit("upload-image"))])
 async def upload_device_image(device_id: str, file: UploadFile = File(...)):
     """Upload an image for a device"""
+    if file.content_type not in IMAGE_CONTENT_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported image content type: {file.content_type!r}")
     try:
-        image_data = await file.read()
-        image_url = s3_handler.store_device_image(device_id, image_data, file.content_type)
+        # Pass the spooled upload through as a file object instead of reading it into memory
+        with admission.reserve("s3"):
+            image_url = await asyncio.to_thread(s3_handler.store_device_image, device_id, file.file, file.content_type)
         if not image_url:
             raise HTTPException(status_code=500, detail="Failed to store image")
         return {"image_url": image_url}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/devices/{device_id}/images")
+@app.get("/devices/{device_id}/images", dependencies=[Depends(admission.limit("images"))])
 async def get_device_images(device_id: str):
     """Get all images for a device"""
     try:
-        return s3_handler.get_device_images(device_id)
+        return await read_coalescer.do("s3.get_device_images", s3_handler.get_device_images, device_id,
+                                       reserve=partial(admission.reserve, "s3"))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/devices/{device_id}/images/upload-url")
+async def create_image_upload_url(device_id: str, content_type: str = "image/jpeg"):
+    """Get a presigned URL to upload a device image directly to S3"""
+    try:
+        return s3_handler.create_image_upload_url(device_id, content_type)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/devices/{device_id}/documents/upload-url")
+async def create_document_upload_url(device_id: str, document_type: str = "pdf"):
+    """Get a presigned URL to upload a device document directly to S3"""
+    try:
+        return s3_handler.create_document_upload_url(device_id, document_type)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/devices/{device_id}/files/download-url")
+async def create_download_url(device_id: str, key: str):
+    """Get a presigned URL to download a device image or document directly from S3"""
+    if not s3_handler.is_device_key(device_id, key):
+        raise HTTPException(status_code=404, detail="File not found")
+    try:
+        return s3_handler.create_download_url(key)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/devices/{device_id}/files/content")
+async def stream_device_file(device_id: str, key: str, range_header: Optional[str] = Header(None, alias="Range")):
+    """Stream a device image or document from S3, honouring a single HTTP byte range"""
+    if not s3_handler.is_device_key(device_id, key):
+        raise HTTPException(status_code=404, detail="File not found")
+    # Only single byte ranges are passed through; anything else gets the full object
+    if range_header and (not range_header.startswith("bytes=") or "," in range_header):
+        range_header = None
+
+    # Slots are held until the body has been streamed, not just until get_object returns
+    endpoint_slot = admission.admit("file-content")
+    try:
+        backend_slot = admission.reserve("s3")
+    except HTTPException:
+        endpoint_slot.release()
+        raise
+    try:
+        response = await asyncio.to_thread(s3_handler.get_object_stream, key, range_header)
+    except ClientError as e:
+        endpoint_slot.release()
+        backend_slot.release()
+        error_code = e.response.get("Error", {}).get("Code")
+        if error_code in ("NoSuchKey", "404"):
+            raise HTTPException(status_code=404, detail="File not found")
+        if error_code == "InvalidRange":
+            raise HTTPException(status_code=416, detail="Requested range not satisfiable")
+        raise HTTPException(status_code=500, detail=str(e))
+    except Exception as e:
+        endpoint_slot.release()
+        backend_slot.release()
+        raise HTTPException(status_code=500, detail=str(e))
+    # Both limits adapt to time to first byte; transfer time depends on object size and client
+    endpoint_slot.mark()
+    backend_slot.mark()
+
+    body = response["Body"]
+
+    async def finish():
+        # Slots are released on the event loop, which owns the limiter counters
+        try:
+            await asyncio.to_thread(body.close)
+        finally:
+            endpoint_slot.release()
+            backend_slot.release()
+
+    async def stream_body():
+        try:
+            chunks = body.iter_chunks(STREAM_CHUNK_SIZE)
+            while True:
+                chunk = await asyncio.to_thread(next, chunks, None)
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            await finish()
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Length": str(response["ContentLength"]),
+        "X-Content-Type-Options": "nosniff"
+    }
+    # Only allow-listed image types are served inline; anything else could be rendered from our origin
+    media_type = response.get("ContentType")
+    if media_type not in IMAGE_CONTENT_TYPES:
+        media_type = "application/octet-stream"
+        headers["Content-Disposition"] = "attachment"
+    if response.get("ContentRange"):
+        headers["Content-Range"] = response["ContentRange"]
+    if response.get("ETag"):
+        headers["ETag"] = response["ETag"]
+    # The background task also runs when the client disconnects mid-stream
+    return StreamingResponse(
+        stream_body(),
+        status_code=206 if response.get("ContentRange") else 200,
+        media_type=media_type,
+        headers=headers,
+        background=BackgroundTask(finish)
+    )
+
 @app.get("/device-types")
 async def get_device_types():
     """Get all unique device types"""
     try:
-        return postgres_handler.get_device_types()
+        return influx_handler.query_device_types()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -138,22 +359,38 @@ async def get_device_types():
 async def get_device_locations():
     """Get all unique device locations"""
     try:
-        return postgres_handler.get_device_locations()
+        return influx_handler.query_device_locations()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.delete("/devices/{device_id}")
+@app.get("/metrics/coalescing")
+async def get_coalescing_metrics():
+    """Get request coalescing counters for the read endpoints"""
+    return read_coalescer.metrics()
+
+@app.get("/metrics/admission")
+async def get_admission_metrics():
+    """Get admission control limits and counters"""
+    return admission.metrics()
+
+@app.delete("/devices/{device_id}", dependencies=[Depends(admission.limit("delete-device"))])
 async def delete_device(device_id: str):
     """Delete all data for a device"""
     try:
         # Delete from S3
-        if not s3_handler.delete_device_data(device_id):
+        with admission.reserve("s3"):
+            deleted = await asyncio.to_thread(s3_handler.delete_device_data, device_id)
+        if not deleted:
             raise HTTPException(status_code=500, detail="Failed to delete device data from S3")
         
+        influx_handler.latest_index.remove(device_id)
+        
         # Note: InfluxDB and PostgreSQL data deletion would need to be implemented
         # in their respective handlers
         
         return {"message": f"Successfully deleted data for device {device_id}"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1,4 +1,6 @@
 import os
+import threading
+import functools
 import psycopg2
 from psycopg2.extras import RealDictCursor
 from datetime import datetime
@@ -7,6 +9,14 @@ from typing import Dict, Any, List
 
 load_dotenv()
 
+def _synchronized(method):
+    """Serialize access to the shared cursor, which is not thread-safe"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
 class PostgreSQLHandler:
     def __init__(self):
         self.conn = psycopg2.connect(
@@ -17,6 +27,7 @@ class PostgreSQLHandler:
             password=os.getenv('POSTGRES_PASSWORD')
         )
         self.cur = self.conn.cursor(cursor_factory=RealDictCursor)
+        self.lock = threading.Lock()
         self._create_tables()
 
     def _create_tables(self):
@@ -55,6 +66,7 @@ class PostgreSQLHandler:
 
         self.conn.commit()
 
+    @_synchronized
     def store_device_metadata(self, metadata: Dict[str, Any]) -> bool:
         """Store device metadata in PostgreSQL"""
         try:
@@ -86,6 +98,7 @@ class PostgreSQLHandler:
             self.conn.rollback()
             return False
 
+    @_synchronized
     def store_system_log(self, log: Dict[str, Any]) -> bool:
         """Store system log in PostgreSQL"""
         try:
@@ -106,6 +119,7 @@ class PostgreSQLHandler:
             self.conn.rollback()
             return False
 
+    @_synchronized
     def get_device_metadata(self, device_id: str = None) -> List[Dict[str, Any]]:
         """Get device metadata for a specific device or all devices"""
         try:
@@ -120,6 +134,7 @@ class PostgreSQLHandler:
             print(f"Error querying device metadata: {str(e)}")
             return []
 
+    @_synchronized
     def get_system_logs(self, device_id: str = None, start_time: str = None, end_time: str = None) -> List[Dict[str, Any]]:
         """Get system logs with optional filters"""
         try:
@@ -144,6 +159,7 @@ class PostgreSQLHandler:
             print(f"Error querying system logs: {str(e)}")
             return []
 
+    @_synchronized
     def get_device_types(self) -> List[str]:
         """Get all unique device types"""
         try:
@@ -153,6 +169,7 @@ class PostgreSQLHandler:
             print(f"Error querying device types: {str(e)}")
             return []
 
+    @_synchronized
     def get_device_locations(self) -> List[str]:
         """Get all unique device locations"""
         try:
@@ -162,6 +179,7 @@ class PostgreSQLHandler:
             print(f"Error querying device locations: {str(e)}")
             return []
 
+    @_synchronized
     def close(self):
         """Close the PostgreSQL connection"""
         self.cur.close()
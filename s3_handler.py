@@ -1,12 +1,36 @@
 import os
+import re
+import uuid
 import boto3
 from datetime import datetime
 from dotenv import load_dotenv
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Union, BinaryIO
 import json
 
 load_dotenv()
 
+DOCUMENT_TYPE_PATTERN = re.compile(r"^[a-z0-9]{1,16}$")
+
+# Image content types accepted for upload, with the key extension each is stored under
+IMAGE_CONTENT_TYPES = {
+    'image/jpeg': 'jpg',
+    'image/png': 'png',
+    'image/webp': 'webp',
+    'image/gif': 'gif'
+}
+
+def _image_extension(content_type: str) -> str:
+    """Get the key extension for an allowed image content type"""
+    if content_type not in IMAGE_CONTENT_TYPES:
+        raise ValueError(f"Unsupported image content type: {content_type!r}")
+    return IMAGE_CONTENT_TYPES[content_type]
+
+def _validate_document_type(document_type: str) -> str:
+    """Reject document types that are unsafe in an object key or content type"""
+    if not DOCUMENT_TYPE_PATTERN.match(document_type or ""):
+        raise ValueError(f"Invalid document type: {document_type!r}")
+    return document_type
+
 class S3Handler:
     def __init__(self):
         self.s3_client = boto3.client(
@@ -16,12 +40,15 @@ class S3Handler:
             region_name=os.getenv('AWS_REGION')
         )
         self.bucket_name = os.getenv('S3_BUCKET_NAME')
+        self.presigned_url_expiry = int(os.getenv('S3_PRESIGNED_URL_EXPIRY', '900'))
 
-    def store_device_image(self, device_id: str, image_data: bytes, content_type: str = 'image/jpeg') -> str:
+    def store_device_image(self, device_id: str, image_data: Union[bytes, BinaryIO], content_type: str = 'image/jpeg') -> str:
         """Store device image in S3"""
+        extension = _image_extension(content_type)
         try:
             timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
-            key = f"images/{device_id}/{timestamp}.jpg"
+            # Suffix keeps concurrent uploads within the same second from overwriting each other
+            key = f"images/{device_id}/{timestamp}_{uuid.uuid4().hex[:8]}.{extension}"
             
             self.s3_client.put_object(
                 Bucket=self.bucket_name,
@@ -135,6 +162,7 @@ class S3Handler:
 
     def store_device_document(self, device_id: str, document_data: bytes, document_type: str):
         """Store device document in S3"""
+        _validate_document_type(document_type)
         timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
         key = f"devices/{device_id}/documents/{timestamp}.{document_type}"
         
@@ -151,30 +179,6 @@ class S3Handler:
             print(f"Error storing document in S3: {str(e)}")
             raise
 
-    def get_device_image(self, device_id: str, image_key: str):
-        """Retrieve device image from S3"""
-        try:
-            response = self.s3_client.get_object(
-                Bucket=self.bucket_name,
-                Key=image_key
-            )
-            return response['Body'].read()
-        except Exception as e:
-            print(f"Error retrieving image from S3: {str(e)}")
-            raise
-
-    def get_device_document(self, device_id: str, document_key: str):
-        """Retrieve device document from S3"""
-        try:
-            response = self.s3_client.get_object(
-                Bucket=self.bucket_name,
-                Key=document_key
-            )
-            return response['Body'].read()
-        except Exception as e:
-            print(f"Error retrieving document from S3: {str(e)}")
-            raise
-
     def list_device_files(self, device_id: str, file_type: str = None):
         """List all files for a device in S3"""
         prefix = f"devices/{device_id}/"
@@ -189,4 +193,78 @@ class S3Handler:
             return [obj['Key'] for obj in response.get('Contents', [])]
         except Exception as e:
             print(f"Error listing files in S3: {str(e)}")
-            raise 
\ No newline at end of file
+            raise
+
+    def is_device_key(self, device_id: str, key: str) -> bool:
+        """Check that an object key belongs to the given device"""
+        return key.startswith((f"images/{device_id}/", f"devices/{device_id}/")) and ".." not in key
+
+    def create_image_upload_url(self, device_id: str, content_type: str = 'image/jpeg') -> Dict[str, Any]:
+        """Create a presigned PUT URL so a client can upload a device image directly to S3"""
+        extension = _image_extension(content_type)
+        timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
+        key = f"images/{device_id}/{timestamp}_{uuid.uuid4().hex[:8]}.{extension}"
+        return self._create_upload_url(key, content_type)
+
+    def create_document_upload_url(self, device_id: str, document_type: str) -> Dict[str, Any]:
+        """Create a presigned PUT URL so a client can upload a device document directly to S3"""
+        _validate_document_type(document_type)
+        timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
+        key = f"devices/{device_id}/documents/{timestamp}_{uuid.uuid4().hex[:8]}.{document_type}"
+        return self._create_upload_url(key, f'application/{document_type}')
+
+    def _create_upload_url(self, key: str, content_type: str) -> Dict[str, Any]:
+        try:
+            upload_url = self.s3_client.generate_presigned_url(
+                'put_object',
+                Params={
+                    'Bucket': self.bucket_name,
+                    'Key': key,
+                    'ContentType': content_type
+                },
+                ExpiresIn=self.presigned_url_expiry
+            )
+            return {
+                'key': key,
+                'url': f"s3://{self.bucket_name}/{key}",
+                'upload_url': upload_url,
+                'content_type': content_type,
+                'expires_in': self.presigned_url_expiry
+            }
+        except Exception as e:
+            print(f"Error creating presigned upload URL: {str(e)}")
+            raise
+
+    def create_download_url(self, key: str) -> Dict[str, Any]:
+        """Create a presigned GET URL so a client can download an object directly from S3"""
+        try:
+            download_url = self.s3_client.generate_presigned_url(
+                'get_object',
+                Params={
+                    'Bucket': self.bucket_name,
+                    'Key': key
+                },
+                ExpiresIn=self.presigned_url_expiry
+            )
+            return {
+                'key': key,
+                'download_url': download_url,
+                'expires_in': self.presigned_url_expiry
+            }
+        except Exception as e:
+            print(f"Error creating presigned download URL: {str(e)}")
+            raise
+
+    def get_object_stream(self, key: str, byte_range: str = None) -> Dict[str, Any]:
+        """Open an object (optionally a byte range of it) without reading the body into memory"""
+        params = {
+            'Bucket': self.bucket_name,
+            'Key': key
+        }
+        if byte_range:
+            params['Range'] = byte_range
+        try:
+            return self.s3_client.get_object(**params)
+        except Exception as e:
+            print(f"Error opening object stream from S3: {str(e)}")
+            raise
@@ -0,0 +1,59 @@
+import asyncio
+from typing import Dict, Any, Callable, Hashable, Tuple, Optional
+
+class SingleFlight:
+    """Merge concurrent identical calls into one backend call and fan the result out to all waiters"""
+
+    def __init__(self):
+        self._in_flight: Dict[Tuple[str, Hashable], asyncio.Future] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    async def do(self, name: str, fn: Callable[..., Any], *args: Hashable,
+                 reserve: Optional[Callable[[], Any]] = None) -> Any:
+        """Run fn(*args) in a worker thread unless an identical call is already in flight
+
+        reserve, if given, is called only when a new backend call starts; it returns a slot
+        whose release() is called when that call finishes, and may raise to reject it.
+        """
+        key = (name, args)
+        stats = self._stats.setdefault(name, {"requests": 0, "backend_calls": 0, "rejected": 0})
+        stats["requests"] += 1
+
+        call = self._in_flight.get(key)
+        if call is None:
+            try:
+                slot = reserve() if reserve else None
+            except Exception:
+                stats["rejected"] += 1
+                raise
+            stats["backend_calls"] += 1
+            # The call runs in its own task so cancelling the request that started it
+            # does not cancel the requests merged into it
+            call = asyncio.ensure_future(asyncio.to_thread(fn, *args))
+            self._in_flight[key] = call
+            call.add_done_callback(lambda done: self._finish(key, done, slot))
+        # shield so one cancelled waiter does not cancel the shared call
+        return await asyncio.shield(call)
+
+    def _finish(self, key: Tuple[str, Hashable], call: asyncio.Future, slot: Any) -> None:
+        del self._in_flight[key]
+        if slot is not None:
+            slot.release()
+        # mark retrieved so a failure nobody is still waiting on is not logged as never consumed
+        if not call.cancelled():
+            call.exception()
+
+    def metrics(self) -> Dict[str, Any]:
+        """Get request, backend call and coalescing ratio counters per call name"""
+        metrics = {}
+        for name, stats in self._stats.items():
+            requests = stats["requests"]
+            coalesced = requests - stats["backend_calls"] - stats["rejected"]
+            metrics[name] = {
+                "requests": requests,
+                "backend_calls": stats["backend_calls"],
+                "rejected": stats["rejected"],
+                "coalesced": coalesced,
+                "coalescing_ratio": round(coalesced / requests, 4) if requests else 0.0
+            }
+        return metrics
@@ -0,0 +1,37 @@
+import threading
+from typing import Dict, List, Iterable, Optional
+
+class TagCatalog:
+    """In-memory catalog of the distinct tag values written to InfluxDB"""
+
+    def __init__(self, tag_keys: Iterable[str]):
+        self._values: Dict[str, set] = {tag_key: set() for tag_key in tag_keys}
+        self._snapshots: Dict[str, List[str]] = {tag_key: [] for tag_key in self._values}
+        self._lock = threading.Lock()
+
+    @property
+    def tag_keys(self) -> List[str]:
+        return list(self._values)
+
+    def record(self, tags: Dict[str, Optional[str]]) -> None:
+        """Record the tag values of a written point, ignoring missing ones"""
+        for tag_key, value in tags.items():
+            if value is None or tag_key not in self._values:
+                continue
+            # Fast path: known values need no lock and no snapshot rebuild
+            if value in self._values[tag_key]:
+                continue
+            self.merge(tag_key, [value])
+
+    def merge(self, tag_key: str, values: Iterable[str]) -> None:
+        """Add values for a tag key, e.g. from a schema.tagValues refresh"""
+        with self._lock:
+            known = self._values[tag_key]
+            new_values = {value for value in values if value is not None} - known
+            if new_values:
+                known.update(new_values)
+                self._snapshots[tag_key] = sorted(known)
+
+    def values(self, tag_key: str) -> List[str]:
+        """Get all known values for a tag key"""
+        return list(self._snapshots.get(tag_key, []))